@@ -18,7 +18,11 @@ tqdm.monitor_interval = 0  # see https://github.com/tqdm/tqdm/issues/481
 
 from .class1_affinity_predictor import Class1AffinityPredictor
 from .encodable_sequences import EncodableSequences
-from .common import configure_logging, random_peptides, amino_acid_distribution
+from .common import (
+    configure_logging,
+    random_peptides,
+    amino_acid_distribution,
+    set_tensor_op_math)
 from .local_parallelism import (
     add_local_parallelism_args,
     worker_pool_with_gpu_assignments_from_args,
@@ -104,6 +108,9 @@ def run(argv=sys.argv[1:]):
 
     args = parser.parse_args(argv)
 
+    # Must run before keras is imported, including in serial runs.
+    set_tensor_op_math(args.precision)
+
     args.models_dir = os.path.abspath(args.models_dir)
 
     configure_logging(verbose=args.verbosity > 1)
@@ -5,7 +5,7 @@ import logging
 import time
 import warnings
 from os.path import join, exists, abspath
-from os import mkdir, environ
+from os import mkdir, environ, remove, getpid
 from socket import gethostname
 from getpass import getuser
 from functools import partial
@@ -46,6 +46,15 @@ class Class1AffinityPredictor(object):
     saving. It also provides a place to keep track of metadata like prediction
     histograms for percentile rank calibration.
     """
+    COMBINED_WEIGHTS_FILES = {}
+    """
+    Process-wide cache of open combined weights files (see
+    `save_combined_weights`), a map from (process id, filename) to numpy
+    NpzFile. Opening the file reads its whole index, so this is done once per
+    process instead of once per model. The process id is part of the key so
+    that forked processes do not share a file handle.
+    """
+
     def __init__(
             self,
             allele_to_allele_specific_models=None,
@@ -325,17 +334,23 @@ class Class1AffinityPredictor(object):
                 str(self.class1_pan_allele_models),
                 str(self.allele_to_allele_specific_models)))
 
-    def save(self, models_dir, model_names_to_write=None, write_metadata=True):
+    def save(
+            self,
+            models_dir,
+            model_names_to_write=None,
+            write_metadata=True,
+            combined_weights=False):
         """
         Serialize the predictor to a directory on disk. If the directory does
         not exist it will be created.
         
         The serialization format consists of a file called "manifest.csv" with
         the configurations of each Class1NeuralNetwork, along with per-network
-        files giving the model weights. If there are pan-allele predictors in
-        the ensemble, the allele sequences are also stored in the
-        directory. There is also a small file "index.txt" with basic metadata:
-        when the models were trained, by whom, on what host.
+        files giving the model weights (or, if combined_weights is True, a
+        single file with the weights of all networks). If there are pan-allele
+        predictors in the ensemble, the allele sequences are also stored in
+        the directory. There is also a small file "index.txt" with basic
+        metadata: when the models were trained, by whom, on what host.
         
         Parameters
         ----------
@@ -348,9 +363,18 @@ class Class1AffinityPredictor(object):
 
         write_metadata : boolean, optional
             Whether to write optional metadata
+
+        combined_weights : boolean, optional
+            Write the weights for all models to a single file instead of one
+            file per model. Any per-model weights files for these models are
+            removed. Cannot be combined with model_names_to_write.
         """
         self.check_consistency()
 
+        if combined_weights and model_names_to_write is not None:
+            raise ValueError(
+                "combined_weights requires writing all models")
+
         if model_names_to_write is None:
             # Write all models
             model_names_to_write = self.manifest_df.model_name.values
@@ -366,13 +390,29 @@ class Class1AffinityPredictor(object):
         # for example due to changes to the allele representation layer.
         # So we update the JSON configs here also.
         updated_network_config_jsons = []
+        model_name_to_weights = collections.OrderedDict()
         for (_, row) in sub_manifest_df.iterrows():
             updated_network_config_jsons.append(
                 json.dumps(row.model.get_config()))
-            weights_path = self.weights_path(models_dir, row.model_name)
-            Class1AffinityPredictor.save_weights(
-                row.model.get_weights(), weights_path)
+            if combined_weights:
+                model_name_to_weights[row.model_name] = row.model.get_weights()
+            else:
+                weights_path = self.weights_path(models_dir, row.model_name)
+                Class1AffinityPredictor.save_weights(
+                    row.model.get_weights(), weights_path)
+                logging.info("Wrote: %s", weights_path)
+        if combined_weights:
+            weights_path = self.combined_weights_path(models_dir)
+            Class1AffinityPredictor.save_combined_weights(
+                model_name_to_weights, weights_path)
             logging.info("Wrote: %s", weights_path)
+
+            # Per-model weights files would take precedence over the combined
+            # file when loading.
+            for model_name in model_name_to_weights:
+                model_weights_path = self.weights_path(models_dir, model_name)
+                if exists(model_weights_path):
+                    remove(model_weights_path)
         sub_manifest_df["config_json"] = updated_network_config_jsons
         self.manifest_df.loc[
             sub_manifest_df.index,
@@ -458,6 +498,18 @@ class Class1AffinityPredictor(object):
         manifest_path = join(models_dir, "manifest.csv")
         manifest_df = pandas.read_csv(manifest_path, nrows=max_models)
 
+        combined_weights_filename = abspath(
+            Class1AffinityPredictor.combined_weights_path(models_dir))
+        model_name_to_num_combined_arrays = collections.Counter()
+        if exists(combined_weights_filename):
+            # Reopen in case the file was rewritten since it was last opened.
+            Class1AffinityPredictor.close_combined_weights(
+                combined_weights_filename)
+            model_name_to_num_combined_arrays.update(
+                key.split("/")[0]
+                for key in Class1AffinityPredictor.open_combined_weights(
+                    combined_weights_filename).files)
+
         allele_to_allele_specific_models = collections.defaultdict(list)
         class1_pan_allele_models = []
         all_models = []
@@ -466,12 +518,23 @@ class Class1AffinityPredictor(object):
                 models_dir, row.model_name)
             config = json.loads(row.config_json)
 
-            # We will lazy-load weights when the network is used.
+            # We will lazy-load weights when the network is used. A per-model
+            # weights file, if present, takes precedence over the combined
+            # weights file, since it may have been written more recently.
+            if model_name_to_num_combined_arrays[row.model_name] and not (
+                    exists(weights_filename)):
+                weights_loader = partial(
+                    Class1AffinityPredictor.load_combined_weights,
+                    combined_weights_filename,
+                    row.model_name,
+                    model_name_to_num_combined_arrays[row.model_name])
+            else:
+                weights_loader = partial(
+                    Class1AffinityPredictor.load_weights,
+                    abspath(weights_filename))
             model = Class1NeuralNetwork.from_config(
                 config,
-                weights_loader=partial(
-                    Class1AffinityPredictor.load_weights,
-                    abspath(weights_filename)))
+                weights_loader=weights_loader)
             if row.allele == "pan-class1":
                 class1_pan_allele_models.append(model)
             else:
@@ -594,6 +657,22 @@ class Class1AffinityPredictor(object):
         """
         return join(models_dir, "weights_%s.npz" % model_name)
 
+    @staticmethod
+    def combined_weights_path(models_dir):
+        """
+        Generate the path to the combined weights file for all models
+        (see `save_combined_weights`)
+
+        Parameters
+        ----------
+        models_dir : string
+
+        Returns
+        -------
+        string
+        """
+        return join(models_dir, "weights.npz")
+
     @property
     def master_allele_encoding(self):
         """
@@ -620,6 +699,8 @@ class Class1AffinityPredictor(object):
             affinities,
             inequalities=None,
             train_rounds=None,
+            train_rounds_decay_epochs=None,
+            reuse_networks=False,
             models_dir_for_save=None,
             verbose=0,
             progress_preamble="",
@@ -652,6 +733,18 @@ class Class1AffinityPredictor(object):
         train_rounds : sequence of int
             Each training point i will be used on training rounds r for which
             train_rounds[i] > r, r >= 0.
+
+        train_rounds_decay_epochs : int, optional
+            If specified, the training rounds are fused into a single fit
+            instead of fitting once per round. Points used in every round keep
+            weight 1.0, and the sample weights of the other points decay
+            linearly over this many epochs, with the points used in the fewest
+            rounds decaying first. Requires train_rounds.
+
+        reuse_networks : bool
+            If True, train each network using a compiled Keras model from the
+            process-wide cache when one with the same architecture is
+            available. See `Class1NeuralNetwork.borrow_cached_training_network`.
         
         models_dir_for_save : string, optional
             If specified, the Class1AffinityPredictor is (incrementally) written
@@ -680,8 +773,30 @@ class Class1AffinityPredictor(object):
             (encodable_peptides, affinities, inequalities)
         ]
 
-        if train_rounds is not None:
-            for round in sorted(set(train_rounds)):
+        sample_weights_schedule = None
+        if train_rounds_decay_epochs:
+            if train_rounds is None:
+                raise ValueError(
+                    "train_rounds_decay_epochs requires train_rounds")
+            train_rounds = numpy.array(train_rounds, copy=False)
+            last_round = train_rounds.max()
+            in_all_rounds = train_rounds == last_round
+
+            def sample_weights_schedule(epoch):
+                # A point used in rounds 0..r decays over the portion
+                # [r / last_round, (r + 1) / last_round] of the decay epochs.
+                # Weights stay slightly above zero since Keras normalizes
+                # each batch by its fraction of nonzero weights, which is
+                # undefined for a batch of only zero-weight points.
+                weights = numpy.clip(
+                    train_rounds + 1 -
+                    last_round * epoch / float(train_rounds_decay_epochs),
+                    1e-6,
+                    1.0)
+                weights[in_all_rounds] = 1.0
+                return weights
+        elif train_rounds is not None:
+            for round in numpy.unique(train_rounds):
                 round_mask = train_rounds > round
                 if round_mask.any():
                     sub_encodable_peptides = EncodableSequences.create(
@@ -721,6 +836,8 @@ class Class1AffinityPredictor(object):
                         round_peptides,
                         round_affinities,
                         inequalities=round_inequalities,
+                        sample_weights_schedule=sample_weights_schedule,
+                        reuse_network=reuse_networks,
                         verbose=verbose,
                         progress_preamble=progress_preamble_template.format(
                             n_peptides=len(round_peptides),
@@ -751,6 +868,151 @@ class Class1AffinityPredictor(object):
         self.clear_cache()
         return models
 
+    @staticmethod
+    def shared_network_hyperparameters(
+            architecture_hyperparameters, num_alleles):
+        """
+        Return the hyperparameters of a multi-output network shared by
+        allele specific predictors for the given number of alleles (see
+        `fit_allele_specific_predictors_with_shared_network`).
+
+        Parameters
+        ----------
+        architecture_hyperparameters : dict
+            Hyperparameters for a single-output network
+
+        num_alleles : int
+
+        Returns
+        -------
+        dict
+        """
+        hyperparameters = dict(Class1NeuralNetwork(
+            **architecture_hyperparameters).hyperparameters)
+        if hyperparameters['num_outputs'] != 1:
+            raise ValueError("Architecture must have a single output")
+        hyperparameters['num_outputs'] = num_alleles
+        if hyperparameters['loss'] == "custom:mse_with_inequalities":
+            hyperparameters['loss'] = (
+                "custom:mse_with_inequalities_and_multiple_outputs")
+        return hyperparameters
+
+    def fit_allele_specific_predictors_with_shared_network(
+            self,
+            n_models,
+            architecture_hyperparameters,
+            alleles,
+            peptides,
+            affinities,
+            inequalities=None,
+            models_dir_for_save=None,
+            verbose=0,
+            progress_preamble="",
+            progress_print_interval=5.0):
+        """
+        Fit allele specific predictors for several alleles at once by training
+        a multi-output neural network with one output per allele. All layers
+        except the output layer are shared across alleles, so each training
+        step operates on the data for all alleles together.
+
+        Random negatives are planned separately for each allele, as for
+        allele specific predictors trained individually.
+
+        After fitting, each network is split into single-output networks (see
+        `Class1NeuralNetwork.split_outputs`), which are added to the
+        Class1AffinityPredictor instance as regular allele specific predictors.
+        Their hyperparameters are as returned by
+        `shared_network_hyperparameters` with num_alleles=1, recording the
+        multiple-output loss they were trained with.
+
+        Parameters
+        ----------
+        n_models : int
+            Number of multi-output neural networks to fit
+
+        architecture_hyperparameters : dict
+
+        alleles : list of string
+            Allele names corresponding to each peptide
+
+        peptides : `EncodableSequences` or list of string
+
+        affinities : list of float
+            nM affinities
+
+        inequalities : list of string, each element one of ">", "<", or "="
+            See `Class1NeuralNetwork.fit` for details.
+
+        models_dir_for_save : string, optional
+            If specified, the Class1AffinityPredictor is (incrementally) written
+            to the given models dir after each neural network is fit.
+
+        verbose : int
+            Keras verbosity
+
+        progress_preamble : string
+            Optional string of information to include in each progress update
+
+        progress_print_interval : float
+            How often (in seconds) to print progress. Set to None to disable.
+
+        Returns
+        -------
+        list of `Class1NeuralNetwork`
+        """
+        alleles = pandas.Series(alleles).map(mhcnames.normalize_allele_name)
+        unique_alleles = sorted(alleles.unique())
+        output_indices = alleles.map(
+            dict((allele, i) for (i, allele) in enumerate(unique_alleles)))
+
+        hyperparameters = self.shared_network_hyperparameters(
+            architecture_hyperparameters, len(unique_alleles))
+
+        for allele in unique_alleles:
+            if allele not in self.allele_to_allele_specific_models:
+                self.allele_to_allele_specific_models[allele] = []
+
+        encodable_peptides = EncodableSequences.create(peptides)
+        models = []
+        for model_num in range(n_models):
+            model = Class1NeuralNetwork(**hyperparameters)
+            model.fit(
+                encodable_peptides,
+                affinities,
+                inequalities=inequalities,
+                output_indices=output_indices.values,
+                random_negatives_per_output=True,
+                verbose=verbose,
+                progress_preamble=(
+                    "[ Model %2d / %2d, %d alleles ] %s" % (
+                        model_num + 1,
+                        n_models,
+                        len(unique_alleles),
+                        progress_preamble)),
+                progress_print_interval=progress_print_interval)
+
+            model_names = []
+            for (allele, allele_model) in zip(
+                    unique_alleles, model.split_outputs()):
+                model_name = self.model_name(allele, model_num)
+                row = pandas.Series(collections.OrderedDict([
+                    ("model_name", model_name),
+                    ("allele", allele),
+                    ("config_json", json.dumps(allele_model.get_config())),
+                    ("model", allele_model),
+                ])).to_frame().T
+                self._manifest_df = pandas.concat(
+                    [self.manifest_df, row], ignore_index=True)
+                self.allele_to_allele_specific_models[allele].append(
+                    allele_model)
+                model_names.append(model_name)
+                models.append(allele_model)
+            if models_dir_for_save:
+                self.save(models_dir_for_save, model_names_to_write=model_names)
+
+        self.clear_cache()
+        return models
+
     def fit_class1_pan_allele_models(
             self,
             n_models,
@@ -1274,6 +1536,88 @@ class Class1AffinityPredictor(object):
             ]
         return weights
 
+    @staticmethod
+    def save_combined_weights(model_name_to_weights, filename):
+        """
+        Save the weights of several models to a single file using numpy's
+        ".npz" format.
+
+        Parameters
+        ----------
+        model_name_to_weights : dict of string -> list of array
+
+        filename : string
+            Should end in ".npz".
+        """
+        Class1AffinityPredictor.close_combined_weights(filename)
+        numpy.savez(
+            filename,
+            **dict(
+                ("%s/array_%d" % (model_name, i), w)
+                for (model_name, weights_list) in model_name_to_weights.items()
+                for (i, w) in enumerate(weights_list)))
+
+    @staticmethod
+    def open_combined_weights(filename):
+        """
+        Return an open numpy NpzFile for the given combined weights file,
+        reusing one already opened by this process if possible (see
+        `COMBINED_WEIGHTS_FILES`).
+
+        Parameters
+        ----------
+        filename : string
+
+        Returns
+        ----------
+        numpy NpzFile
+        """
+        key = (getpid(), abspath(filename))
+        if key not in Class1AffinityPredictor.COMBINED_WEIGHTS_FILES:
+            Class1AffinityPredictor.COMBINED_WEIGHTS_FILES[key] = numpy.load(
+                filename)
+        return Class1AffinityPredictor.COMBINED_WEIGHTS_FILES[key]
+
+    @staticmethod
+    def close_combined_weights(filename):
+        """
+        Close any handles to the given combined weights file opened by
+        `open_combined_weights`.
+
+        Parameters
+        ----------
+        filename : string
+        """
+        for key in list(Class1AffinityPredictor.COMBINED_WEIGHTS_FILES):
+            if key[1] == abspath(filename):
+                Class1AffinityPredictor.COMBINED_WEIGHTS_FILES.pop(key).close()
+
+    @staticmethod
+    def load_combined_weights(filename, model_name, num_arrays):
+        """
+        Restore the weights for one model from the given filename, which should
+        have been created with `save_combined_weights`.
+
+        Parameters
+        ----------
+        filename : string
+            Should end in ".npz".
+
+        model_name : string
+
+        num_arrays : int
+            Number of weight arrays for the model
+
+        Returns
+        ----------
+        list of array
+        """
+        loaded = Class1AffinityPredictor.open_combined_weights(filename)
+        return [
+            loaded["%s/array_%d" % (model_name, i)]
+            for i in range(num_arrays)
+        ]
+
     def calibrate_percentile_ranks(
             self,
             peptides=None,
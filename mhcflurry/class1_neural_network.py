@@ -29,6 +29,10 @@ if os.environ.get("MHCFLURRY_DEFAULT_PREDICT_BATCH_SIZE"):
     logging.info(
         "Configured default predict batch size: %d" % DEFAULT_PREDICT_BATCH_SIZE)
 
+# Upper bound on the number of random negative peptides generated and encoded
+# together when fitting. See Class1NeuralNetwork.fit.
+RANDOM_NEGATIVE_PEPTIDES_PER_ENCODING_BATCH = 100000
+
 
 class Class1NeuralNetwork(object):
     """
@@ -187,12 +191,69 @@ class Class1NeuralNetwork(object):
     (Keras model, existing network weights)
     """
 
+    KERAS_TRAINING_MODELS_CACHE = {}
+    """
+    Process-wide cache of compiled Keras models for training, a map from:
+    training cache key (see `training_network_cache_key`) to (Keras model,
+    weak reference to the Class1NeuralNetwork currently using it)
+    """
+
     @classmethod
     def clear_model_cache(klass):
         """
-        Clear the Keras model cache.
+        Clear the Keras model caches.
         """
         klass.KERAS_MODELS_CACHE.clear()
+        klass.KERAS_TRAINING_MODELS_CACHE.clear()
+
+    def training_network_cache_key(self):
+        """
+        Return a key that identifies the compiled Keras model used to train
+        this predictor. Predictors that share the same key can be trained
+        using the same compiled model, after re-initializing its weights.
+
+        Returns
+        -------
+        string
+        """
+        return json.dumps({
+            'network': self.network_hyperparameter_defaults.subselect(
+                self.hyperparameters),
+            'loss': self.hyperparameters['loss'],
+            'optimizer': self.hyperparameters['optimizer'],
+            'learning_rate': self.hyperparameters['learning_rate'],
+        }, sort_keys=True)
+
+    def borrow_cached_training_network(self):
+        """
+        Take a compiled Keras model with this predictor's architecture from the
+        process-wide training cache, re-initializing its weights and optimizer
+        state. This avoids building and compiling a new model, which is a
+        large fixed cost when training many small models.
+
+        The predictor that previously used the model keeps a copy of its
+        weights and builds its own model when next needed.
+
+        Returns
+        -------
+        keras.models.Model, or None if there is no cached model with this
+        architecture
+        """
+        from keras import backend as K
+        key = self.training_network_cache_key()
+        if key not in self.KERAS_TRAINING_MODELS_CACHE:
+            return None
+        (network, owner_ref) = self.KERAS_TRAINING_MODELS_CACHE[key]
+        owner = owner_ref()
+        if owner is not None and owner._network is network:
+            owner.update_network_description()
+            owner._network = None
+        K.get_session().run([
+            variable.initializer
+            for variable in network.weights + network.optimizer.weights
+        ])
+        self.KERAS_TRAINING_MODELS_CACHE[key] = (network, weakref.ref(self))
+        return network
 
     @classmethod
     def borrow_cached_network(klass, network_json, network_weights):
@@ -672,6 +733,96 @@ class Class1NeuralNetwork(object):
         fit_info["num_points"] = mutable_generator_state["yielded_values"]
         self.fit_info.append(dict(fit_info))
 
+    def plan_random_negatives(
+            self,
+            peptides,
+            affinities,
+            allele_encoding=None,
+            inequalities=None,
+            output_indices=None,
+            per_output=False):
+        """
+        Plan the random negative peptides to use when fitting.
+
+        Parameters
+        ----------
+        peptides : EncodableSequences or list of string
+
+        affinities : list of float
+
+        allele_encoding : AlleleEncoding
+
+        inequalities : list of string
+
+        output_indices : list of int
+
+        per_output : bool
+            If True, random negatives are planned separately for each output
+            using only that output's training examples, as they would be for
+            single-output predictors trained on each output's data alone.
+            Requires output_indices and no allele_encoding. If False, there is
+            a single plan for all the data and, for multi-output predictors,
+            random negatives are assigned to outputs sampled uniformly from
+            the random_negative_output_indices hyperparameter (by default all
+            outputs).
+
+        Returns
+        -------
+        (list of (int or None, RandomNegativePeptides), numpy.array of int)
+
+        The planners, each paired with the output index it was planned for
+        (None unless per_output is set), and the output index of each random
+        negative (None if output_indices is not specified). Random negatives
+        are ordered by planner.
+        """
+        encodable_peptides = EncodableSequences.create(peptides)
+
+        def make_planner():
+            return RandomNegativePeptides(
+                **RandomNegativePeptides.hyperparameter_defaults.subselect(
+                    self.hyperparameters))
+
+        planners = []
+        if per_output:
+            if allele_encoding is not None or output_indices is None:
+                raise ValueError(
+                    "Planning random negatives per output requires "
+                    "output_indices and no allele_encoding")
+            output_indices = numpy.array(output_indices, copy=False)
+            affinities = numpy.array(affinities, copy=False)
+            for output_index in numpy.unique(output_indices):
+                mask = output_indices == output_index
+                planner = make_planner()
+                planner.plan(
+                    peptides=encodable_peptides.sequences[mask],
+                    affinities=affinities[mask],
+                    inequalities=(
+                        None if inequalities is None
+                        else numpy.array(inequalities, copy=False)[mask]))
+                planners.append((output_index, planner))
+            random_negative_output_indices = numpy.repeat(
+                [output_index for (output_index, _) in planners],
+                [planner.get_total_count() for (_, planner) in planners],
+            ).astype(int)
+        else:
+            planner = make_planner()
+            planner.plan(
+                peptides=encodable_peptides.sequences,
+                affinities=affinities,
+                alleles=allele_encoding.alleles if allele_encoding else None,
+                inequalities=inequalities)
+            planners.append((None, planner))
+            random_negative_output_indices = None
+            if output_indices is not None:
+                output_indices_to_sample = (
+                    self.hyperparameters['random_negative_output_indices']
+                    if self.hyperparameters['random_negative_output_indices']
+                    else list(range(0, self.hyperparameters['num_outputs'])))
+                random_negative_output_indices = pandas.Series(
+                    output_indices_to_sample, dtype=int).sample(
+                        n=planner.get_total_count(), replace=True).values
+        return (planners, random_negative_output_indices)
+
     def fit(
             self,
             peptides,
@@ -680,7 +831,10 @@ class Class1NeuralNetwork(object):
             inequalities=None,
             output_indices=None,
             sample_weights=None,
+            sample_weights_schedule=None,
             shuffle_permutation=None,
+            reuse_network=False,
+            random_negatives_per_output=False,
             verbose=1,
             progress_callback=None,
             progress_preamble="",
@@ -714,10 +868,28 @@ class Class1NeuralNetwork(object):
             during training) will have equal weight. If specified, the random
             negatives will be assigned weight=1.0.
 
+        sample_weights_schedule : function
+            Function taking the epoch number (starting from 0) and returning
+            a list of float, same length as peptides, giving the sample
+            weights to use for that epoch. These are multiplied by
+            sample_weights, if specified. Since validation losses computed
+            with different weights are not comparable, the minimum validation
+            loss used for early stopping is reset whenever the weights change.
+
         shuffle_permutation : list of int
             Permutation (integer list) of same length as peptides and affinities
             If None, then a random permutation will be generated.
 
+        reuse_network : bool
+            If True and this predictor does not yet have a network, train a
+            compiled Keras model from the process-wide training cache (see
+            `borrow_cached_training_network`) when one with the same
+            architecture is available. Only supported for single-allele
+            predictors.
+
+        random_negatives_per_output : bool
+            See `plan_random_negatives`.
+
         verbose : int
             Keras verbosity level
 
@@ -736,21 +908,23 @@ class Class1NeuralNetwork(object):
         peptide_encoding = self.peptides_to_network_input(encodable_peptides)
         fit_info = collections.defaultdict(list)
 
-        random_negatives_planner = RandomNegativePeptides(
-            **RandomNegativePeptides.hyperparameter_defaults.subselect(
-                self.hyperparameters))
-        random_negatives_planner.plan(
-            peptides=encodable_peptides.sequences,
-            affinities=affinities,
-            alleles=allele_encoding.alleles if allele_encoding else None,
-            inequalities=inequalities)
+        (random_negatives_planners, random_negative_output_indices) = (
+            self.plan_random_negatives(
+                encodable_peptides,
+                affinities,
+                allele_encoding=allele_encoding,
+                inequalities=inequalities,
+                output_indices=output_indices,
+                per_output=random_negatives_per_output))
 
         random_negatives_allele_encoding = None
         if allele_encoding is not None:
             random_negatives_allele_encoding = AlleleEncoding(
-                random_negatives_planner.get_alleles(),
+                random_negatives_planners[0][1].get_alleles(),
                 borrow_from=allele_encoding)
-        num_random_negatives = random_negatives_planner.get_total_count()
+        num_random_negatives = sum(
+            planner.get_total_count()
+            for (_, planner) in random_negatives_planners)
 
         y_values = from_ic50(numpy.array(affinities, copy=False))
         assert numpy.isnan(y_values).sum() == 0, y_values
@@ -812,6 +986,15 @@ class Class1NeuralNetwork(object):
                 raise ValueError(
                     "Must supply output_indices for multi-output predictor")
 
+        if reuse_network and allele_representations is not None:
+            raise ValueError(
+                "reuse_network is only supported for single-allele predictors")
+
+        needs_compile = True
+        if self.network() is None and reuse_network:
+            self._network = self.borrow_cached_training_network()
+            needs_compile = self._network is None
+
         if self.network() is None:
             self._network = self.make_network(
                 allele_representations=allele_representations,
@@ -823,8 +1006,13 @@ class Class1NeuralNetwork(object):
         if allele_representations is not None:
             self.set_allele_representations(allele_representations)
 
-        self.network().compile(
-            loss=loss.loss, optimizer=self.hyperparameters['optimizer'])
+        if needs_compile:
+            self.network().compile(
+                loss=loss.loss, optimizer=self.hyperparameters['optimizer'])
+            if reuse_network:
+                self.KERAS_TRAINING_MODELS_CACHE[
+                    self.training_network_cache_key()
+                ] = (self.network(), weakref.ref(self))
 
         if self.hyperparameters['learning_rate'] is not None:
             K.set_value(
@@ -872,17 +1060,16 @@ class Class1NeuralNetwork(object):
             sample_weights_with_random_negatives = numpy.concatenate([
                 numpy.ones(num_random_negatives),
                 sample_weights])
+        elif sample_weights_schedule is not None:
+            # Filled in each epoch from the schedule.
+            sample_weights_with_random_negatives = numpy.ones(
+                num_random_negatives + len(y_values))
         else:
             sample_weights_with_random_negatives = None
 
-        if output_indices is not None:
-            random_negative_output_indices = (
-                self.hyperparameters['random_negative_output_indices']
-                if self.hyperparameters['random_negative_output_indices']
-                else list(range(0, self.hyperparameters['num_outputs'])))
+        if random_negative_output_indices is not None:
             output_indices_with_random_negatives = numpy.concatenate([
-                pandas.Series(random_negative_output_indices, dtype=int).sample(
-                    n=num_random_negatives, replace=True).values,
+                random_negative_output_indices,
                 output_indices
             ])
         else:
@@ -902,6 +1089,7 @@ class Class1NeuralNetwork(object):
 
         min_val_loss_iteration = None
         min_val_loss = None
+        last_scheduled_sample_weights = None
 
         # Initialization required if a data_dependent_initialization_method
         # is set and this is our first time fitting (i.e. fit_info is empty).
@@ -912,14 +1100,36 @@ class Class1NeuralNetwork(object):
         start = time.time()
         last_progress_print = None
         x_dict_with_random_negatives = {}
+        random_negative_peptides_encodings = []
         for i in range(self.hyperparameters['max_epochs']):
-            random_negative_peptides = EncodableSequences.create(
-                random_negatives_planner.get_peptides())
+            if not random_negative_peptides_encodings:
+                # Random negatives are generated and encoded for several
+                # epochs at once. Encoding has a large fixed cost per call,
+                # which otherwise dominates each epoch for small datasets.
+                num_epochs_to_generate = int(min(
+                    self.hyperparameters['max_epochs'] - i,
+                    max(
+                        1,
+                        RANDOM_NEGATIVE_PEPTIDES_PER_ENCODING_BATCH //
+                        max(num_random_negatives, 1))))
+                random_negative_peptides = []
+                for _ in range(num_epochs_to_generate):
+                    for (_, planner) in random_negatives_planners:
+                        random_negative_peptides.extend(planner.get_peptides())
+                encoding = self.peptides_to_network_input(
+                    EncodableSequences.create(random_negative_peptides))
+                random_negative_peptides_encodings = [
+                    encoding[
+                        j * num_random_negatives :
+                        (j + 1) * num_random_negatives
+                    ]
+                    for j in range(num_epochs_to_generate)
+                ]
             random_negative_peptides_encoding = (
-                self.peptides_to_network_input(random_negative_peptides))
+                random_negative_peptides_encodings.pop(0))
 
             if not x_dict_with_random_negatives:
-                if len(random_negative_peptides) > 0:
+                if num_random_negatives > 0:
                     x_dict_with_random_negatives[
                         "peptide"
                     ] = numpy.concatenate([
@@ -940,7 +1150,7 @@ class Class1NeuralNetwork(object):
             else:
                 # Update x_dict_with_random_negatives in place.
                 # This is more memory efficient than recreating it as above.
-                if len(random_negative_peptides) > 0:
+                if num_random_negatives > 0:
                     x_dict_with_random_negatives[
                         "peptide"
                     ][:num_random_negatives] = random_negative_peptides_encoding
@@ -954,6 +1164,20 @@ class Class1NeuralNetwork(object):
                     verbose=verbose)
                 needs_initialization = False
 
+            if sample_weights_schedule is not None:
+                scheduled_sample_weights = numpy.array(
+                    sample_weights_schedule(i), copy=False)[shuffle_permutation]
+                if last_scheduled_sample_weights is not None and not (
+                        numpy.array_equal(
+                            scheduled_sample_weights,
+                            last_scheduled_sample_weights)):
+                    min_val_loss = None
+                    min_val_loss_iteration = None
+                last_scheduled_sample_weights = scheduled_sample_weights
+                sample_weights_with_random_negatives[num_random_negatives:] = (
+                    scheduled_sample_weights if sample_weights is None
+                    else scheduled_sample_weights * sample_weights)
+
             epoch_start = time.time()
             fit_history = self.network().fit(
                 x_dict_with_random_negatives,
@@ -1219,6 +1443,52 @@ class Class1NeuralNetwork(object):
                 layer_names)
         return result
 
+    def split_outputs(self):
+        """
+        Split a multi-output network into single-output networks.
+
+        Each resulting network has the same weights as this network for all
+        layers except the output layer, which is restricted to the weights for
+        the corresponding output.
+
+        Only allele-specific (i.e. not pan-allele) networks are supported.
+
+        Returns
+        -------
+        list of Class1NeuralNetwork
+            One network for each output, ordered by output index.
+        """
+        network = self.network()
+        if len(network.inputs) != 1:
+            raise ValueError(
+                "Splitting outputs is only supported for allele-specific "
+                "networks")
+
+        # The output layer is always the final layer, so its kernel and bias
+        # are the last two weight matrices.
+        weights = network.get_weights()
+        (output_kernel, output_bias) = weights[-2:]
+        num_outputs = self.hyperparameters['num_outputs']
+        assert output_kernel.shape[-1] == num_outputs, output_kernel.shape
+
+        hyperparameters = dict(self.hyperparameters)
+        hyperparameters['num_outputs'] = 1
+
+        results = []
+        for i in range(num_outputs):
+            result = Class1NeuralNetwork(**hyperparameters)
+            result._network = result.make_network(
+                **result.network_hyperparameter_defaults.subselect(
+                    result.hyperparameters))
+            result._network.set_weights(
+                weights[:-2] + [
+                    output_kernel[:, i : i + 1],
+                    output_bias[i : i + 1],
+                ])
+            result.fit_info = [dict(info) for info in self.fit_info]
+            results.append(result)
+        return results
+
     def make_network(
             self,
             peptide_encoding,
@@ -13,6 +13,8 @@ import pickle
 import subprocess
 import shutil
 
+import numpy
+
 from .local_parallelism import call_wrapped_kwargs
 from .class1_affinity_predictor import Class1AffinityPredictor
 
@@ -21,6 +23,55 @@ try:
 except ImportError:
     from pipes import quote
 
+# Numpy arrays in the constant data at least this large are written to their
+# own files and memory mapped by the workers.
+MEMORY_MAP_MIN_ARRAY_BYTES = 1024 * 1024
+
+
+class MemoryMappedArrayPickler(pickle.Pickler):
+    """
+    Pickler that writes large numpy arrays to separate .npy files in the given
+    directory instead of including them in the pickle.
+
+    When loaded with `MemoryMappedArrayUnpickler`, these arrays are memory
+    mapped, so workers running on the same host share one copy of them in the
+    page cache instead of each reading a private copy into memory.
+    """
+    def __init__(self, fd, array_dir, min_bytes=MEMORY_MAP_MIN_ARRAY_BYTES):
+        pickle.Pickler.__init__(self, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        self.array_dir = array_dir
+        self.min_bytes = min_bytes
+        self.array_paths = {}
+
+    def persistent_id(self, obj):
+        if (type(obj) is not numpy.ndarray or obj.dtype.hasobject or
+                obj.nbytes < self.min_bytes):
+            return None
+        # Arrays referenced more than once are written once. We keep a
+        # reference to each array so its id is not reused by a temporary
+        # array created while pickling.
+        if id(obj) not in self.array_paths:
+            path = os.path.join(
+                self.array_dir, "array.%d.npy" % len(self.array_paths))
+            numpy.save(path, obj, allow_pickle=False)
+            print("Wrote:", path)
+            self.array_paths[id(obj)] = (path, obj)
+        return self.array_paths[id(obj)][0]
+
+
+class MemoryMappedArrayUnpickler(pickle.Unpickler):
+    """
+    Unpickler for data written by `MemoryMappedArrayPickler`.
+
+    Arrays that were written to separate files are loaded as `numpy.memmap`
+    instances. Each reference to such an array in the pickled data gives a
+    separate `numpy.memmap` of the same file. Arrays are mapped copy-on-write,
+    so code that modifies them in place gets a private copy of the modified
+    pages and the files are left unchanged.
+    """
+    def persistent_load(self, path):
+        return numpy.load(path, mmap_mode="c")
+
 
 def add_cluster_parallelism_args(parser):
     """
@@ -167,7 +218,7 @@ def cluster_results(
 
     constant_payload_path = os.path.join(work_dir, "global_data.pkl")
     with open(constant_payload_path, "wb") as fd:
-        pickle.dump(constant_payload, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        MemoryMappedArrayPickler(fd, work_dir).dump(constant_payload)
     print("Wrote:", constant_payload_path)
     if clear_constant_data:
         constant_data.clear()
@@ -350,7 +401,7 @@ def worker_entry_point(argv=sys.argv[1:]):
     args = parser.parse_args(argv)
 
     with open(args.constant_data, "rb") as fd:
-        constant_payload = pickle.load(fd)
+        constant_payload = MemoryMappedArrayUnpickler(fd).load()
 
     with open(args.worker_data, "rb") as fd:
         worker_data = pickle.load(fd)
@@ -68,6 +68,32 @@ def set_keras_backend(backend=None, gpu_device_nums=None, num_threads=None):
                 " customization. Backend: %s" % K.backend())
 
 
+def set_tensor_op_math(precision="fp32"):
+    """
+    Configure the float32 matrix math precision tensorflow uses on GPUs.
+
+    Must be called before tensorflow is imported, since the setting is read
+    from environment variables when the CUDA libraries are initialized.
+
+    Parameters
+    ----------
+    precision : string
+        "fp32" (the default) leaves the environment unchanged.
+        "fp16-tensor-ops" allows cuBLAS and cuDNN to run float32 matrix
+        multiplications and convolutions on tensor cores (Volta and newer
+        GPUs) by converting the inputs to float16. This is faster but lowers
+        the precision of these operations, which may affect model accuracy.
+    """
+    if precision == "fp32":
+        return
+    if precision != "fp16-tensor-ops":
+        raise ValueError("Unsupported precision: %s" % precision)
+    for key in [
+            "TF_ENABLE_CUBLAS_TENSOR_OP_MATH_FP32",
+            "TF_ENABLE_CUDNN_TENSOR_OP_MATH_FP32"]:
+        os.environ[key] = "1"
+
+
 def configure_logging(verbose=False):
     """
     Configure logging module using defaults.
@@ -244,11 +244,12 @@ class EncodableSequences(object):
         """
         result = None
         if alignment_method == 'pad_middle':
-            # Result array is int32, filled with X (null amino acid) value.
+            # Result array is uint8 (indices are < 21), filled with X (null amino
+            # acid) value.
             result = numpy.full(
                 fill_value=amino_acid.AMINO_ACID_INDEX['X'],
                 shape=(len(sequences), max_length),
-                dtype="int32")
+                dtype="uint8")
 
             df = pandas.DataFrame({"peptide": sequences}, dtype=numpy.object_)
             df["length"] = df.peptide.str.len()
@@ -274,7 +275,7 @@ class EncodableSequences(object):
                     sub_df.peptide.map(
                         lambda s: numpy.array([
                             amino_acid.AMINO_ACID_INDEX[char] for char in s
-                        ])).values)
+                        ], dtype="uint8")).values)
 
                 num_null = max_length - length
                 num_null_left = int(math.ceil(num_null / 2))
@@ -304,11 +305,12 @@ class EncodableSequences(object):
             # could handle smaller peptides.
             min_length = 5
 
-            # Result array is int32, filled with X (null amino acid) value.
+            # Result array is uint8 (indices are < 21), filled with X (null amino
+            # acid) value.
             result = numpy.full(
                 fill_value=amino_acid.AMINO_ACID_INDEX['X'],
                 shape=(len(sequences), max_length * 2),
-                dtype="int32")
+                dtype="uint8")
 
             df = pandas.DataFrame({"peptide": sequences}, dtype=numpy.object_)
 
@@ -329,7 +331,7 @@ class EncodableSequences(object):
                 fixed_length_sequences = numpy.stack(sub_df.peptide.map(
                     lambda s: numpy.array([
                         amino_acid.AMINO_ACID_INDEX[char] for char in s
-                    ])).values)
+                    ], dtype="uint8")).values)
 
                 # Set left edge
                 result[sub_df.index, :length] = fixed_length_sequences
@@ -341,11 +343,12 @@ class EncodableSequences(object):
             # could handle smaller peptides.
             min_length = 5
 
-            # Result array is int32, filled with X (null amino acid) value.
+            # Result array is uint8 (indices are < 21), filled with X (null amino
+            # acid) value.
             result = numpy.full(
                 fill_value=amino_acid.AMINO_ACID_INDEX['X'],
                 shape=(len(sequences), max_length * 3),
-                dtype="int32")
+                dtype="uint8")
 
             df = pandas.DataFrame({"peptide": sequences}, dtype=numpy.object_)
 
@@ -366,7 +369,7 @@ class EncodableSequences(object):
                 fixed_length_sequences = numpy.stack(sub_df.peptide.map(
                     lambda s: numpy.array([
                         amino_acid.AMINO_ACID_INDEX[char] for char in s
-                    ])).values)
+                    ], dtype="uint8")).values)
 
                 # Set left edge
                 result[sub_df.index, :length] = fixed_length_sequences
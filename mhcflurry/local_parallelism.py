@@ -15,7 +15,7 @@ import random
 
 import numpy
 
-from .common import set_keras_backend
+from .common import set_keras_backend, set_tensor_op_math
 
 
 def add_local_parallelism_args(parser):
@@ -45,6 +45,15 @@ def add_local_parallelism_args(parser):
         metavar="N",
         help="Number of GPUs to attempt to parallelize across. Requires running "
              "in parallel.")
+    group.add_argument(
+        "--precision",
+        choices=("fp32", "fp16-tensor-ops"),
+        default="fp32",
+        help="Float32 matrix math precision on GPUs. Specify "
+             "'fp16-tensor-ops' to run float32 matrix multiplications and "
+             "convolutions on tensor cores (Volta or newer GPUs) in reduced "
+             "(float16) precision. This is faster but may affect model "
+             "accuracy. Default: %(default)s.")
     group.add_argument(
         "--max-workers-per-gpu",
         type=int,
@@ -59,6 +68,13 @@ def add_local_parallelism_args(parser):
         default=None,
         help="Restart workers after N tasks. Workaround for tensorflow memory "
              "leaks. Requires Python >=3.2.")
+    group.add_argument(
+        "--threads-per-worker",
+        type=int,
+        metavar="N",
+        default=None,
+        help="Number of tensorflow and BLAS threads for each worker process. "
+             "If not specified, the CPUs are divided evenly among the workers.")
     group.add_argument(
         "--worker-log-dir",
         default=None,
@@ -84,8 +100,10 @@ def worker_pool_with_gpu_assignments_from_args(args):
         num_jobs=args.num_jobs,
         num_gpus=args.gpus,
         backend=args.backend,
+        precision=args.precision,
         max_workers_per_gpu=args.max_workers_per_gpu,
         max_tasks_per_worker=args.max_tasks_per_worker,
+        threads_per_worker=args.threads_per_worker,
         worker_log_dir=args.worker_log_dir,
     )
 
@@ -94,8 +112,10 @@ def worker_pool_with_gpu_assignments(
         num_jobs,
         num_gpus=0,
         backend=None,
+        precision="fp32",
         max_workers_per_gpu=1,
         max_tasks_per_worker=None,
+        threads_per_worker=None,
         worker_log_dir=None):
     """
     Create a multiprocessing.Pool where each worker uses its own GPU.
@@ -106,8 +126,14 @@ def worker_pool_with_gpu_assignments(
         Number of worker processes.
     num_gpus : int
     backend : string
+    precision : string
+        See `set_tensor_op_math`
     max_workers_per_gpu : int
     max_tasks_per_worker : int
+    threads_per_worker : int
+        Number of tensorflow and BLAS threads for each worker. If not
+        specified, the CPUs are divided evenly among the workers, so that
+        workers do not each start a thread per CPU and oversubscribe them.
     worker_log_dir : string
 
     Returns
@@ -115,6 +141,9 @@ def worker_pool_with_gpu_assignments(
     multiprocessing.Pool
     """
 
+    # Set before any tensorflow import (here or in the forked workers).
+    set_tensor_op_math(precision)
+
     if num_jobs == 0:
         if backend:
             set_keras_backend(backend)
@@ -151,6 +180,12 @@ def worker_pool_with_gpu_assignments(
             print("Worker %d assigned GPUs: %s" % (
                 worker_num, gpu_assignment))
 
+    if not threads_per_worker:
+        threads_per_worker = max(1, cpu_count() // num_jobs)
+    print("Using %d threads per worker." % threads_per_worker)
+    for kwargs in worker_init_kwargs:
+        kwargs["num_threads"] = threads_per_worker
+
     if worker_log_dir:
         for kwargs in worker_init_kwargs:
             kwargs["worker_log_dir"] = worker_log_dir
@@ -259,7 +294,11 @@ def worker_init_entry_point(
     init_function(**kwargs)
 
 
-def worker_init(keras_backend=None, gpu_device_nums=None, worker_log_dir=None):
+def worker_init(
+        keras_backend=None,
+        gpu_device_nums=None,
+        num_threads=None,
+        worker_log_dir=None):
     if worker_log_dir:
         sys.stderr = sys.stdout = open(os.path.join(
             worker_log_dir,
@@ -268,11 +307,18 @@ def worker_init(keras_backend=None, gpu_device_nums=None, worker_log_dir=None):
     # Each worker needs distinct random numbers
     numpy.random.seed()
     random.seed()
-    if keras_backend or gpu_device_nums:
-        print("WORKER pid=%d assigned GPU devices: %s" % (
-            os.getpid(), gpu_device_nums))
+    if num_threads:
+        # Must be set before tensorflow is imported in this worker, since its
+        # MKL / OpenMP thread pool is sized at import time.
+        for key in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+            os.environ.setdefault(key, str(num_threads))
+    if keras_backend or gpu_device_nums or num_threads:
+        print("WORKER pid=%d assigned GPU devices: %s, threads: %s" % (
+            os.getpid(), gpu_device_nums, num_threads))
         set_keras_backend(
-            keras_backend, gpu_device_nums=gpu_device_nums)
+            keras_backend,
+            gpu_device_nums=gpu_device_nums,
+            num_threads=num_threads)
 
 
 # Solution suggested in https://bugs.python.org/issue13831
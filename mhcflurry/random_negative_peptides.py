@@ -236,12 +236,12 @@ class RandomNegativePeptides(object):
 
         Returns
         -------
-        list of string
+        numpy.array of string
         """
         assert self.plan_df is not None, "Call plan() first"
-        alleles = []
-        for allele, row in self.plan_df.iterrows():
-            alleles.extend([allele] * int(row.sum()))
+        alleles = numpy.repeat(
+            self.plan_df.index.values,
+            self.plan_df.sum(axis=1).values.astype(int))
         assert len(alleles) == self.get_total_count()
         return alleles
 
@@ -24,7 +24,7 @@ tqdm.monitor_interval = 0  # see https://github.com/tqdm/tqdm/issues/481
 from .class1_affinity_predictor import Class1AffinityPredictor
 from .encodable_sequences import EncodableSequences
 from .allele_encoding import AlleleEncoding
-from .common import configure_logging
+from .common import configure_logging, set_tensor_op_math
 from .local_parallelism import (
     worker_pool_with_gpu_assignments_from_args,
     add_local_parallelism_args)
@@ -139,6 +139,9 @@ def run(argv=sys.argv[1:]):
 
     args = parser.parse_args(argv)
 
+    # Must run before keras is imported, including in serial runs.
+    set_tensor_op_math(args.precision)
+
     args.out_models_dir = os.path.abspath(args.out_models_dir)
 
     configure_logging(verbose=args.verbosity > 1)
@@ -2,24 +2,24 @@
 Train Class1 single allele models.
 """
 import argparse
+import collections
 import os
 import signal
 import sys
 import time
 import traceback
-import random
 from functools import partial
 
+import numpy
 import pandas
 import yaml
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.model_selection import StratifiedKFold
 from mhcnames import normalize_allele_name
 import tqdm  # progress bar
 tqdm.monitor_interval = 0  # see https://github.com/tqdm/tqdm/issues/481
 
 from .class1_affinity_predictor import Class1AffinityPredictor
-from .common import configure_logging
+from .class1_neural_network import Class1NeuralNetwork
+from .common import configure_logging, set_tensor_op_math
 from .local_parallelism import (
     add_local_parallelism_args,
     worker_pool_with_gpu_assignments_from_args,
@@ -108,6 +108,28 @@ parser.add_argument(
     "--allele-sequences",
     metavar="FILE.csv",
     help="Allele sequences file. Used for computing allele similarity matrix.")
+parser.add_argument(
+    "--shared-network",
+    action="store_true",
+    default=False,
+    help="Instead of training separate networks for each allele, train one "
+    "network per architecture and replicate with an output for each allele. "
+    "All other layers are shared across alleles. Networks are split into "
+    "per-allele models after training.")
+parser.add_argument(
+    "--reuse-networks",
+    action="store_true",
+    default=False,
+    help="Within each process, train successive models with the same "
+    "architecture using one compiled Keras model, re-initializing its weights "
+    "each time instead of building and compiling a new model.")
+parser.add_argument(
+    "--combined-weights-file",
+    action="store_true",
+    default=False,
+    help="When saving the final predictor, write the weights for all models "
+    "to a single file instead of one file per model. Models are still saved "
+    "to separate files during training.")
 parser.add_argument(
     "--save-interval",
     type=float,
@@ -115,6 +137,13 @@ parser.add_argument(
     default=60,
     help="Write models to disk every N seconds. Only affects parallel runs; "
     "serial runs write each model to disk as it is trained.")
+parser.add_argument(
+    "--continue-incomplete",
+    action="store_true",
+    default=False,
+    help="Continue an incomplete training run. Models already present in "
+    "--out-models-dir are kept and only the missing models (for each allele "
+    "and architecture) are trained.")
 parser.add_argument(
     "--verbosity",
     type=int,
@@ -126,6 +155,7 @@ add_local_parallelism_args(parser)
 TRAIN_DATA_HYPERPARAMETER_DEFAULTS = HyperparameterDefaults(
     subset="all",
     pretrain_min_points=None,
+    pretrain_decay_epochs=None,
 )
 
 
@@ -138,6 +168,12 @@ def run(argv=sys.argv[1:]):
 
     args = parser.parse_args(argv)
 
+    if args.shared_network and args.reuse_networks:
+        parser.error("--reuse-networks is not supported with --shared-network")
+
+    # Must run before keras is imported, including in serial runs.
+    set_tensor_op_math(args.precision)
+
     args.out_models_dir = os.path.abspath(args.out_models_dir)
 
     configure_logging(verbose=args.verbosity > 1)
@@ -189,10 +225,21 @@ def run(argv=sys.argv[1:]):
         os.mkdir(args.out_models_dir)
         print("Done.")
 
-    predictor = Class1AffinityPredictor(
-        metadata_dataframes={
-            'train_data': df,
-        })
+    if args.continue_incomplete and os.path.exists(
+            os.path.join(args.out_models_dir, "manifest.csv")):
+        # It's important that we don't trigger a Keras import here since that
+        # breaks local parallelism (tensorflow backend). So we set
+        # optimization_level=0.
+        predictor = Class1AffinityPredictor.load(
+            args.out_models_dir, optimization_level=0)
+        predictor.metadata_dataframes['train_data'] = df
+        print("Loaded predictor with %d networks" % (
+            len(predictor.neural_networks)))
+    else:
+        predictor = Class1AffinityPredictor(
+            metadata_dataframes={
+                'train_data': df,
+            })
     serial_run = args.num_jobs == 0
 
     work_items = []
@@ -213,8 +260,43 @@ def run(argv=sys.argv[1:]):
             TRAIN_DATA_HYPERPARAMETER_DEFAULTS.with_defaults(
                 hyperparameters.get('train_data', {})))
 
+        if args.shared_network and (
+                hyperparameters['train_data']['pretrain_min_points'] or
+                hyperparameters['train_data']['pretrain_decay_epochs']):
+            parser.error(
+                "pretrain_min_points and pretrain_decay_epochs are not "
+                "supported with --shared-network")
+        if hyperparameters['train_data']['pretrain_decay_epochs'] and not (
+                hyperparameters['train_data']['pretrain_min_points']):
+            parser.error(
+                "pretrain_decay_epochs requires pretrain_min_points")
+
+        # Count the models already trained for this architecture, so we can
+        # skip them before doing any other work.
+        if args.shared_network:
+            full_hyperparameters = (
+                Class1AffinityPredictor.shared_network_hyperparameters(
+                    hyperparameters, 1))
+        else:
+            full_hyperparameters = Class1NeuralNetwork(
+                **hyperparameters).hyperparameters
+        full_hyperparameters = normalize_hyperparameters(full_hyperparameters)
+        num_existing_models = collections.Counter(dict(
+            (allele, sum(
+                normalize_hyperparameters(model.hyperparameters) ==
+                full_hyperparameters
+                for model in models))
+            for (allele, models)
+            in predictor.allele_to_allele_specific_models.items()))
+
+        # Index the training data by allele before any workers are forked,
+        # so they all share it.
+        train_data_allele_rows(hyperparameters['train_data']['subset'])
+
         if hyperparameters['train_data']['pretrain_min_points'] and (
                 'allele_similarity_matrix' not in GLOBAL_DATA):
+            from sklearn.metrics.pairwise import cosine_similarity
+
             print("Generating allele similarity matrix.")
             if not args.allele_sequences:
                 parser.error(
@@ -241,8 +323,31 @@ def run(argv=sys.argv[1:]):
             print("Computed allele similarity matrix")
             print(allele_similarity_matrix)
 
+        if args.shared_network:
+            # Each shared network is trained only on the alleles that still
+            # need another model.
+            first_model_num = min(
+                num_existing_models[allele] for allele in df.allele.unique())
+            for model_num in range(first_model_num, n_models):
+                work_dict = {
+                    'n_models': 1,
+                    'alleles': [
+                        allele for allele in df.allele.unique()
+                        if num_existing_models[allele] <= model_num
+                    ],
+                    'hyperparameter_set_num': h,
+                    'num_hyperparameter_sets': len(hyperparameters_lst),
+                    'hyperparameters': hyperparameters,
+                    'verbose': args.verbosity,
+                    'progress_print_interval': None if not serial_run else 5.0,
+                    'predictor': predictor if serial_run else None,
+                    'save_to': args.out_models_dir if serial_run else None,
+                }
+                work_items.append(work_dict)
+            continue
+
         for (i, allele) in enumerate(df.allele.unique()):
-            for model_num in range(n_models):
+            for model_num in range(num_existing_models[allele], n_models):
                 work_dict = {
                     'n_models': 1,
                     'allele_num': i,
@@ -251,6 +356,7 @@ def run(argv=sys.argv[1:]):
                     'num_hyperparameter_sets': len(hyperparameters_lst),
                     'allele': allele,
                     'hyperparameters': hyperparameters,
+                    'reuse_networks': args.reuse_networks,
                     'verbose': args.verbosity,
                     'progress_print_interval': None if not serial_run else 5.0,
                     'predictor': predictor if serial_run else None,
@@ -258,19 +364,41 @@ def run(argv=sys.argv[1:]):
                 }
                 work_items.append(work_dict)
 
+    if args.continue_incomplete:
+        print("Will train %d models not already present in %s." % (
+            len(work_items), args.out_models_dir))
+
+    if not work_items:
+        print("No models to train.")
+        return
+
+    work_function = (
+        train_shared_network_model if args.shared_network else train_model)
+
     start = time.time()
 
+    if not serial_run and len(work_items) < args.num_jobs:
+        # Each work item (one allele, architecture, and replicate) is trained
+        # independently, so workers beyond the number of items would sit idle.
+        print("Reducing number of local processes from %d to %d (the number "
+              "of work items)." % (args.num_jobs, len(work_items)))
+        args.num_jobs = len(work_items)
+
     worker_pool = worker_pool_with_gpu_assignments_from_args(args)
 
     if worker_pool:
         print("Processing %d work items in parallel." % len(work_items))
 
-        # The estimated time to completion is more accurate if we randomize
-        # the order of the work.
-        random.shuffle(work_items)
+        # Start the alleles with the most training data first. Training time
+        # scales with the number of points, so this way the many small
+        # alleles fill in around the large ones at the end instead of a large
+        # allele being picked up last while the other workers sit idle.
+        allele_num_points = df.allele.value_counts()
+        work_items.sort(
+            key=lambda item: -allele_num_points.get(item.get('allele'), 0))
 
         results_generator = worker_pool.imap_unordered(
-            partial(call_wrapped_kwargs, train_model),
+            partial(call_wrapped_kwargs, work_function),
             work_items,
             chunksize=1)
 
@@ -305,12 +433,14 @@ def run(argv=sys.argv[1:]):
         # as it goes so no saving is required at the end.
         for _ in tqdm.trange(len(work_items)):
             item = work_items.pop(0)  # want to keep freeing up memory
-            work_predictor = train_model(**item)
+            work_predictor = work_function(**item)
             assert work_predictor is predictor
         assert not work_items
 
     print("Saving final predictor to: %s" % args.out_models_dir)
-    predictor.save(args.out_models_dir)  # write all models just to be sure
+    # Write all models just to be sure.
+    predictor.save(
+        args.out_models_dir, combined_weights=args.combined_weights_file)
     print("Done.")
 
     print("*" * 30)
@@ -340,6 +470,60 @@ def alleles_by_similarity(allele):
     ).sort_values(ascending=False).index.tolist()
 
 
+def normalize_hyperparameters(hyperparameters):
+    """
+    Fill in defaults for the train_data hyperparameters, so that models
+    trained before a train_data hyperparameter was added still match the
+    current hyperparameters when checking for existing models.
+
+    Parameters
+    ----------
+    hyperparameters : dict
+
+    Returns
+    -------
+    dict
+    """
+    result = dict(hyperparameters)
+    result['train_data'] = TRAIN_DATA_HYPERPARAMETER_DEFAULTS.with_defaults(
+        result.get('train_data', {}))
+    return result
+
+
+def train_data_allele_rows(subset="all"):
+    """
+    Return a dict from allele to the row positions of its measurements in the
+    training data, restricted to the given subset of the data.
+
+    The result is computed once for each subset and cached in GLOBAL_DATA, so
+    that work items do not each need to scan the full training data. The
+    cache is recomputed if GLOBAL_DATA["train_data"] has been replaced.
+
+    Parameters
+    ----------
+    subset : string
+        One of "all" or "quantitative"
+
+    Returns
+    -------
+    dict of string -> numpy.array of int
+    """
+    key = "train_data_allele_rows_%s" % subset
+    data = GLOBAL_DATA["train_data"]
+    if key not in GLOBAL_DATA or GLOBAL_DATA[key][0] is not data:
+        rows = numpy.arange(len(data))
+        if subset == "quantitative":
+            rows = rows[(data.measurement_type == "quantitative").values]
+        elif subset != "all":
+            raise ValueError("Unsupported subset: %s" % subset)
+        row_alleles = data.allele.values[rows]
+        GLOBAL_DATA[key] = (data, dict(
+            (allele, rows[positions])
+            for (allele, positions)
+            in pandas.Series(row_alleles).groupby(row_alleles).indices.items()))
+    return GLOBAL_DATA[key][1]
+
+
 def train_model(
         n_models,
         allele_num,
@@ -348,6 +532,7 @@ def train_model(
         num_hyperparameter_sets,
         allele,
         hyperparameters,
+        reuse_networks,
         verbose,
         progress_print_interval,
         predictor,
@@ -361,28 +546,24 @@ def train_model(
     data = GLOBAL_DATA["train_data"]
 
     subset = hyperparameters.get("train_data", {}).get("subset", "all")
-    if subset == "quantitative":
-        data = data.loc[
-            data.measurement_type == "quantitative"
-        ]
-    elif subset == "all":
-        pass
-    else:
-        raise ValueError("Unsupported subset: %s" % subset)
-
-    data_size_by_allele = data.allele.value_counts()
+    allele_to_rows = train_data_allele_rows(subset)
+    no_rows = numpy.array([], dtype=int)
 
     if pretrain_min_points:
         similar_alleles = alleles_by_similarity(allele)
         alleles = []
-        while not alleles or data_size_by_allele.loc[alleles].sum() < pretrain_min_points:
-            alleles.append(similar_alleles.pop(0))
-        data = data.loc[data.allele.isin(alleles)]
+        num_points = 0
+        while not alleles or num_points < pretrain_min_points:
+            similar_allele = similar_alleles.pop(0)
+            if similar_allele not in alleles:
+                alleles.append(similar_allele)
+                num_points += len(allele_to_rows.get(similar_allele, no_rows))
+        data = data.iloc[numpy.concatenate([
+            allele_to_rows.get(a, no_rows) for a in alleles
+        ])]
         assert len(data) >= pretrain_min_points, (len(data), pretrain_min_points)
-        train_rounds = (data.allele == allele).astype(int).values
     else:
-        train_rounds = None
-        data = data.loc[data.allele == allele]
+        data = data.iloc[allele_to_rows.get(allele, no_rows)]
 
     progress_preamble = (
         "[%2d / %2d hyperparameters] "
@@ -394,6 +575,9 @@ def train_model(
             allele))
 
     train_data = data.sample(frac=1.0)
+    train_rounds = (
+        (train_data.allele == allele).astype(int).values
+        if pretrain_min_points else None)
     predictor.fit_allele_specific_predictors(
         n_models=n_models,
         architecture_hyperparameters_list=[hyperparameters],
@@ -404,6 +588,55 @@ def train_model(
             train_data.measurement_inequality.values
             if "measurement_inequality" in train_data.columns else None),
         train_rounds=train_rounds,
+        train_rounds_decay_epochs=(
+            hyperparameters['train_data']['pretrain_decay_epochs']),
+        reuse_networks=reuse_networks,
+        models_dir_for_save=save_to,
+        progress_preamble=progress_preamble,
+        progress_print_interval=progress_print_interval,
+        verbose=verbose)
+
+    return predictor
+
+
+def train_shared_network_model(
+        n_models,
+        alleles,
+        hyperparameter_set_num,
+        num_hyperparameter_sets,
+        hyperparameters,
+        verbose,
+        progress_print_interval,
+        predictor,
+        save_to):
+
+    if predictor is None:
+        predictor = Class1AffinityPredictor()
+
+    data = GLOBAL_DATA["train_data"]
+
+    subset = hyperparameters.get("train_data", {}).get("subset", "all")
+    allele_to_rows = train_data_allele_rows(subset)
+    data = data.iloc[numpy.concatenate([
+        allele_to_rows[allele]
+        for allele in sorted(alleles) if allele in allele_to_rows
+    ])]
+
+    progress_preamble = (
+        "[%2d / %2d hyperparameters] " % (
+            hyperparameter_set_num + 1,
+            num_hyperparameter_sets))
+
+    train_data = data.sample(frac=1.0)
+    predictor.fit_allele_specific_predictors_with_shared_network(
+        n_models=n_models,
+        architecture_hyperparameters=hyperparameters,
+        alleles=train_data.allele.values,
+        peptides=train_data.peptide.values,
+        affinities=train_data.measurement_value.values,
+        inequalities=(
+            train_data.measurement_inequality.values
+            if "measurement_inequality" in train_data.columns else None),
         models_dir_for_save=save_to,
         progress_preamble=progress_preamble,
         progress_print_interval=progress_print_interval,
@@ -413,6 +646,8 @@ def train_model(
 
 
 def subselect_df_held_out(df, recriprocal_held_out_fraction=10, seed=0):
+    from sklearn.model_selection import StratifiedKFold
+
     df = df.copy()
     df["allele_peptide"] = df.allele + "_" + df.peptide
 
@@ -422,12 +657,8 @@ def subselect_df_held_out(df, recriprocal_held_out_fraction=10, seed=0):
         random_state=seed)
 
     # Stratify by both allele and binder vs. nonbinder.
-    df["key"] = [
-        "%s_%s" % (
-            row.allele,
-            "binder" if row.measurement_value <= 500 else "nonbinder")
-        for (_, row) in df.iterrows()
-    ]
+    df["key"] = df.allele + "_" + numpy.where(
+        df.measurement_value <= 500, "binder", "nonbinder")
 
     (train, test) = next(kf.split(df, df.key))
     selected_allele_peptides = df.iloc[train].allele_peptide.unique()
@@ -23,7 +23,7 @@ tqdm.monitor_interval = 0  # see https://github.com/tqdm/tqdm/issues/481
 
 from .class1_affinity_predictor import Class1AffinityPredictor
 from .class1_neural_network import Class1NeuralNetwork
-from .common import configure_logging
+from .common import configure_logging, set_tensor_op_math
 from .local_parallelism import (
     add_local_parallelism_args,
     worker_pool_with_gpu_assignments_from_args,
@@ -281,6 +281,9 @@ def main(args):
     print("Arguments:")
     print(args)
 
+    # Must run before keras is imported, including in serial runs.
+    set_tensor_op_math(args.precision)
+
     args.out_models_dir = os.path.abspath(args.out_models_dir)
     configure_logging(verbose=args.verbosity > 1)
 
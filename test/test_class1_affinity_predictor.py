@@ -1,3 +1,4 @@
+import os
 import tempfile
 import shutil
 import logging
@@ -14,6 +15,7 @@ from mhcflurry import Class1AffinityPredictor
 from nose.tools import eq_, assert_raises
 from numpy import testing
 
+from mhcflurry.common import random_peptides
 from mhcflurry.downloads import get_path
 from mhcflurry.testing_utils import cleanup, startup
 
@@ -265,3 +267,80 @@ def test_predict_implementations_equivalent():
                 centrality_measure=centrality_measure).prediction.values
             testing.assert_almost_equal(pred1, pred2, decimal=2)
 
+
+def test_save_combined_weights():
+    predictor = Class1AffinityPredictor.load(
+        max_models=2, optimization_level=0)
+    peptides = ["SIINFEKL", "SYYNFIIIKL", "SIINKFELQY"]
+    pred1 = predictor.predict(allele="HLA-A02:01", peptides=peptides)
+
+    models_dir = tempfile.mkdtemp("_models")
+    predictor.save(models_dir)
+    predictor.save(models_dir, combined_weights=True)
+    for model_name in predictor.manifest_df.model_name:
+        assert not os.path.exists(
+            Class1AffinityPredictor.weights_path(models_dir, model_name))
+    assert os.path.exists(
+        Class1AffinityPredictor.combined_weights_path(models_dir))
+
+    predictor2 = Class1AffinityPredictor.load(
+        models_dir, optimization_level=0)
+    eq_(len(predictor2.neural_networks), 2)
+    pred2 = predictor2.predict(allele="HLA-A02:01", peptides=peptides)
+    testing.assert_almost_equal(pred1, pred2, decimal=4)
+
+    with assert_raises(ValueError):
+        predictor2.save(
+            models_dir,
+            model_names_to_write=predictor2.manifest_df.model_name.values[:1],
+            combined_weights=True)
+    shutil.rmtree(models_dir)
+
+
+def test_fit_with_train_rounds_decay_epochs():
+    hyperparameters = dict(
+        activation="tanh",
+        layer_sizes=[8],
+        max_epochs=5,
+        early_stopping=False,
+        validation_split=0.0,
+        random_negative_rate=0.0,
+        random_negative_constant=0,
+        dropout_probability=0.0)
+    peptides = random_peptides(100, length=9)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    train_rounds = numpy.array([0, 1] * 50)
+
+    # Without decay epochs, each round is a separate fit.
+    predictor = Class1AffinityPredictor()
+    (model,) = predictor.fit_allele_specific_predictors(
+        n_models=1,
+        architecture_hyperparameters_list=[hyperparameters],
+        allele="HLA-A*02:01",
+        peptides=peptides,
+        affinities=affinities,
+        train_rounds=train_rounds)
+    eq_(len(model.fit_info), 2)
+
+    # With decay epochs, the rounds are fused into a single fit.
+    predictor = Class1AffinityPredictor()
+    (model,) = predictor.fit_allele_specific_predictors(
+        n_models=1,
+        architecture_hyperparameters_list=[hyperparameters],
+        allele="HLA-A*02:01",
+        peptides=peptides,
+        affinities=affinities,
+        train_rounds=train_rounds,
+        train_rounds_decay_epochs=3)
+    eq_(len(model.fit_info), 1)
+    eq_(len(model.fit_info[0]["loss"]), 5)
+    assert not numpy.isnan(model.fit_info[0]["loss"]).any()
+
+    with assert_raises(ValueError):
+        predictor.fit_allele_specific_predictors(
+            n_models=1,
+            architecture_hyperparameters_list=[hyperparameters],
+            allele="HLA-A*02:01",
+            peptides=peptides,
+            affinities=affinities,
+            train_rounds_decay_epochs=3)
@@ -177,3 +177,69 @@ def test_inequalities():
     numpy.testing.assert_array_less(
         5.0, df.loc[df.value == 1].prediction1.values)
     print(df.groupby("value")[["prediction1", "prediction2"]].mean())
+
+
+def test_sample_weights_schedule():
+    hyperparameters = dict(
+        activation="tanh",
+        layer_sizes=[8],
+        max_epochs=5,
+        early_stopping=True,
+        patience=0,
+        validation_split=0.2,
+        random_negative_rate=0.0,
+        random_negative_constant=0,
+        dropout_probability=0.0)
+
+    df = pandas.DataFrame()
+    df["peptide"] = random_peptides(100, length=9)
+    df["value"] = 100
+    df["round"] = [0, 1] * 50
+
+    scheduled_epochs = []
+
+    def schedule(epoch):
+        scheduled_epochs.append(epoch)
+        return numpy.where(df["round"] == 1, 1.0, 1.0 / (epoch + 1))
+
+    predictor = Class1NeuralNetwork(**hyperparameters)
+    predictor.fit(
+        df.peptide.values,
+        df.value.values,
+        sample_weights_schedule=schedule,
+        verbose=0)
+
+    # The weights change every epoch, so early stopping never triggers.
+    eq_(scheduled_epochs, list(range(5)))
+    eq_(len(predictor.fit_info[-1]["loss"]), 5)
+
+
+def test_reuse_network():
+    hyperparameters = dict(
+        activation="tanh",
+        layer_sizes=[8],
+        max_epochs=3,
+        early_stopping=False,
+        validation_split=0.0,
+        random_negative_rate=0.0,
+        random_negative_constant=0,
+        dropout_probability=0.0)
+
+    peptides = random_peptides(100, length=9)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+
+    predictor1 = Class1NeuralNetwork(**hyperparameters)
+    predictor1.fit(peptides, affinities, reuse_network=True, verbose=0)
+    network = predictor1.network()
+    predictions1 = predictor1.predict(peptides)
+
+    predictor2 = Class1NeuralNetwork(**hyperparameters)
+    predictor2.fit(peptides, affinities[::-1], reuse_network=True, verbose=0)
+
+    # The second predictor trained the first predictor's compiled model, and
+    # the first predictor kept its own weights.
+    assert predictor2.network() is network
+    assert predictor1.network() is not network
+    testing.assert_allclose(
+        predictor1.predict(peptides), predictions1, rtol=1e-5)
+    Class1NeuralNetwork.clear_model_cache()
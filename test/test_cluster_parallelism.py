@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+import pandas
+from numpy import testing
+from nose.tools import eq_
+
+from mhcflurry.cluster_parallelism import (
+    MEMORY_MAP_MIN_ARRAY_BYTES,
+    MemoryMappedArrayPickler,
+    MemoryMappedArrayUnpickler)
+
+
+def test_memory_mapped_array_pickling():
+    work_dir = tempfile.mkdtemp(prefix="mhcflurry-test-cluster")
+    num_large = MEMORY_MAP_MIN_ARRAY_BYTES // 8 + 1
+
+    large = numpy.arange(num_large, dtype="float64")
+    small = numpy.arange(10)
+    objects = numpy.array(["x"] * num_large, dtype=object)
+    df = pandas.DataFrame({"a": large, "b": large * 2})
+    data = {
+        "large": large,
+        "large_again": large,
+        "small": small,
+        "objects": objects,
+        "df": df,
+    }
+
+    path = os.path.join(work_dir, "data.pkl")
+    with open(path, "wb") as fd:
+        MemoryMappedArrayPickler(fd, work_dir).dump(data)
+
+    # One file for the large array (referenced twice but written once) and
+    # one for the DataFrame's float block.
+    array_files = [
+        filename for filename in os.listdir(work_dir)
+        if filename.endswith(".npy")
+    ]
+    eq_(len(array_files), 2)
+
+    with open(path, "rb") as fd:
+        loaded = MemoryMappedArrayUnpickler(fd).load()
+
+    assert isinstance(loaded["large"], numpy.memmap)
+    assert isinstance(loaded["large_again"], numpy.memmap)
+    testing.assert_array_equal(loaded["large"], large)
+    testing.assert_array_equal(loaded["large_again"], large)
+
+    assert not isinstance(loaded["small"], numpy.memmap)
+    testing.assert_array_equal(loaded["small"], small)
+
+    assert not isinstance(loaded["objects"], numpy.memmap)
+    testing.assert_array_equal(loaded["objects"], objects)
+
+    pandas.testing.assert_frame_equal(loaded["df"], df)
+
+    shutil.rmtree(work_dir)
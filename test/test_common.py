@@ -0,0 +1,31 @@
+import os
+
+from nose.tools import eq_, assert_raises
+
+from mhcflurry.common import set_tensor_op_math
+
+TENSOR_OP_MATH_VARIABLES = [
+    "TF_ENABLE_CUBLAS_TENSOR_OP_MATH_FP32",
+    "TF_ENABLE_CUDNN_TENSOR_OP_MATH_FP32",
+]
+
+
+def test_set_tensor_op_math():
+    original_environ = dict(os.environ)
+    try:
+        for key in TENSOR_OP_MATH_VARIABLES:
+            os.environ.pop(key, None)
+
+        set_tensor_op_math("fp32")
+        for key in TENSOR_OP_MATH_VARIABLES:
+            assert key not in os.environ
+
+        set_tensor_op_math("fp16-tensor-ops")
+        for key in TENSOR_OP_MATH_VARIABLES:
+            eq_(os.environ[key], "1")
+
+        with assert_raises(ValueError):
+            set_tensor_op_math("tf32")
+    finally:
+        os.environ.clear()
+        os.environ.update(original_environ)
@@ -0,0 +1,55 @@
+import argparse
+import os
+from multiprocessing import cpu_count
+
+from nose.tools import eq_
+
+from mhcflurry.local_parallelism import (
+    add_local_parallelism_args,
+    worker_pool_with_gpu_assignments_from_args)
+
+THREAD_ENVIRONMENT_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+]
+
+
+def worker_thread_environment(_):
+    return tuple(
+        os.environ.get(key) for key in THREAD_ENVIRONMENT_VARIABLES)
+
+
+def worker_thread_environments(argv):
+    parser = argparse.ArgumentParser()
+    add_local_parallelism_args(parser)
+    args = parser.parse_args(argv)
+
+    original_environment = dict(
+        (key, os.environ.pop(key))
+        for key in THREAD_ENVIRONMENT_VARIABLES
+        if key in os.environ)
+    try:
+        worker_pool = worker_pool_with_gpu_assignments_from_args(args)
+    finally:
+        os.environ.update(original_environment)
+    try:
+        return set(worker_pool.map(
+            worker_thread_environment, range(args.num_jobs * 4), chunksize=1))
+    finally:
+        worker_pool.close()
+        worker_pool.join()
+
+
+def test_threads_per_worker():
+    eq_(
+        worker_thread_environments(
+            ["--num-jobs", "2", "--threads-per-worker", "3"]),
+        {("3", "3", "3")})
+
+
+def test_default_threads_per_worker():
+    expected = str(max(1, cpu_count() // 2))
+    eq_(
+        worker_thread_environments(["--num-jobs", "2"]),
+        {(expected, expected, expected)})
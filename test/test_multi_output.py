@@ -89,3 +89,84 @@ def test_multi_output():
     assert sub_correlation.iloc[1, 1] > 0.99, correlation
     assert sub_correlation.iloc[2, 2] > 0.99, correlation
 
+
+def test_split_outputs():
+    hyperparameters = dict(
+        loss="custom:mse_with_inequalities_and_multiple_outputs",
+        activation="tanh",
+        layer_sizes=[8],
+        max_epochs=5,
+        minibatch_size=250,
+        random_negative_rate=0.0,
+        random_negative_constant=0.0,
+        early_stopping=False,
+        validation_split=0.0,
+        dense_layer_l1_regularization=0.0,
+        dropout_probability=0.0,
+        optimizer="adam",
+        num_outputs=3)
+
+    peptides = random_peptides(1000, length=9)
+    predictor = Class1NeuralNetwork(**hyperparameters)
+    predictor.fit(
+        peptides,
+        numpy.random.uniform(10, 50000, len(peptides)),
+        output_indices=numpy.random.randint(0, 3, len(peptides)),
+        verbose=0)
+
+    combined = predictor.predict(peptides, output_index=None)
+    split_predictors = predictor.split_outputs()
+    eq_(len(split_predictors), 3)
+    for (i, split_predictor) in enumerate(split_predictors):
+        eq_(split_predictor.hyperparameters['num_outputs'], 1)
+        testing.assert_allclose(
+            split_predictor.predict(peptides), combined[:, i], rtol=1e-5)
+
+
+def test_plan_random_negatives_per_output():
+    hyperparameters = dict(
+        loss="custom:mse_with_inequalities_and_multiple_outputs",
+        random_negative_rate=0.5,
+        random_negative_constant=2,
+        num_outputs=3)
+
+    peptides = random_peptides(300, length=9) + random_peptides(100, length=10)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    output_indices = numpy.random.randint(0, 3, len(peptides))
+    predictor = Class1NeuralNetwork(**hyperparameters)
+
+    (planners, random_negative_output_indices) = (
+        predictor.plan_random_negatives(
+            peptides,
+            affinities,
+            output_indices=output_indices,
+            per_output=True))
+    eq_([output_index for (output_index, _) in planners], [0, 1, 2])
+
+    # Each output gets the random negatives a single-output predictor
+    # trained on that output's data alone would get.
+    single_output_predictor = Class1NeuralNetwork(
+        **dict(hyperparameters, num_outputs=1))
+    for (output_index, planner) in planners:
+        mask = output_indices == output_index
+        ((_, expected_planner),), _ = (
+            single_output_predictor.plan_random_negatives(
+                numpy.array(peptides)[mask], affinities[mask]))
+        eq_(planner.get_total_count(), expected_planner.get_total_count())
+        eq_(
+            (random_negative_output_indices == output_index).sum(),
+            planner.get_total_count())
+
+    eq_(
+        list(random_negative_output_indices),
+        sorted(random_negative_output_indices))
+
+    # Without per_output, random negatives are planned once for all the
+    # data and assigned to outputs at random.
+    (planners, random_negative_output_indices) = (
+        predictor.plan_random_negatives(
+            peptides, affinities, output_indices=output_indices))
+    eq_(len(planners), 1)
+    eq_(
+        len(random_negative_output_indices),
+        planners[0][1].get_total_count())
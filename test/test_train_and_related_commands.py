@@ -9,9 +9,12 @@ import tempfile
 import subprocess
 from copy import deepcopy
 
+import numpy
+import pandas
 from numpy.testing import assert_array_less, assert_equal
 
 from mhcflurry import Class1AffinityPredictor
+from mhcflurry import train_allele_specific_models_command
 from mhcflurry.downloads import get_path
 
 from mhcflurry.testing_utils import cleanup, startup
@@ -164,6 +167,113 @@ def run_and_check_with_model_selection(n_jobs=1):
     shutil.rmtree(models_dir1)
 
 
+def test_continue_incomplete():
+    models_dir = tempfile.mkdtemp(prefix="mhcflurry-test-models")
+    hyperparameters_filename = os.path.join(
+        models_dir, "hyperparameters.yaml")
+    with open(hyperparameters_filename, "w") as fd:
+        json.dump(HYPERPARAMETERS, fd)
+
+    base_args = [
+        "mhcflurry-class1-train-allele-specific-models",
+        "--data", get_path("data_curated", "curated_training_data.no_mass_spec.csv.bz2"),
+        "--hyperparameters", hyperparameters_filename,
+        "--allele", "HLA-A*02:01",
+        "--out-models-dir", models_dir,
+        "--max-epochs", "10",
+    ]
+    args = base_args + ["--n-models", "1"]
+    print("Running with args: %s" % args)
+    subprocess.check_call(args)
+    result = Class1AffinityPredictor.load(models_dir)
+    assert_equal(len(result.neural_networks), 1)
+    (original_weights,) = [
+        model.get_weights() for model in result.neural_networks
+    ]
+
+    args = base_args + ["--n-models", "2", "--continue-incomplete"]
+    print("Running with args: %s" % args)
+    subprocess.check_call(args)
+    result = Class1AffinityPredictor.load(models_dir)
+    assert_equal(len(result.neural_networks), 2)
+    assert any(
+        all((w1 == w2).all() for (w1, w2) in zip(
+            original_weights, model.get_weights()))
+        for model in result.neural_networks)
+
+    # Nothing left to train: the models directory is not rewritten.
+    manifest_path = os.path.join(models_dir, "manifest.csv")
+    manifest_mtime = os.path.getmtime(manifest_path)
+    args = base_args + ["--n-models", "2", "--continue-incomplete"]
+    print("Running with args: %s" % args)
+    subprocess.check_call(args)
+    assert_equal(os.path.getmtime(manifest_path), manifest_mtime)
+
+    print("Deleting: %s" % models_dir)
+    shutil.rmtree(models_dir)
+
+
+def test_shared_network():
+    models_dir = tempfile.mkdtemp(prefix="mhcflurry-test-models")
+    hyperparameters_filename = os.path.join(
+        models_dir, "hyperparameters.yaml")
+    with open(hyperparameters_filename, "w") as fd:
+        json.dump(HYPERPARAMETERS, fd)
+
+    args = [
+        "mhcflurry-class1-train-allele-specific-models",
+        "--data", get_path("data_curated", "curated_training_data.no_mass_spec.csv.bz2"),
+        "--hyperparameters", hyperparameters_filename,
+        "--allele", "HLA-A*02:01", "HLA-A*03:01",
+        "--out-models-dir", models_dir,
+        "--n-models", "1",
+        "--max-epochs", "10",
+        "--shared-network",
+    ]
+    print("Running with args: %s" % args)
+    subprocess.check_call(args)
+
+    result = Class1AffinityPredictor.load(models_dir)
+    assert_equal(len(result.neural_networks), 2)
+    for allele in ["HLA-A*02:01", "HLA-A*03:01"]:
+        (model,) = result.allele_to_allele_specific_models[allele]
+        assert_equal(model.hyperparameters["num_outputs"], 1)
+        assert_equal(
+            model.hyperparameters["random_negative_constant"],
+            HYPERPARAMETERS[0]["random_negative_constant"])
+        predictions = result.predict(peptides=["SLYNTVATL"], allele=allele)
+        assert_equal(predictions.shape, (1,))
+        assert numpy.isfinite(predictions).all()
+
+    print("Deleting: %s" % models_dir)
+    shutil.rmtree(models_dir)
+
+
+def test_train_data_allele_rows():
+    global_data = train_allele_specific_models_command.GLOBAL_DATA
+    global_data.clear()
+    global_data["train_data"] = pandas.DataFrame({
+        "allele": ["A", "B", "A"],
+        "measurement_type": ["quantitative", "qualitative", "quantitative"],
+    })
+    allele_to_rows = train_allele_specific_models_command.train_data_allele_rows()
+    assert_equal(sorted(allele_to_rows), ["A", "B"])
+    assert_equal(allele_to_rows["A"], [0, 2])
+
+    # Replacing the training data must not reuse the cached rows.
+    global_data["train_data"] = pandas.DataFrame({
+        "allele": ["B", "A"],
+        "measurement_type": ["quantitative", "quantitative"],
+    })
+    allele_to_rows = train_allele_specific_models_command.train_data_allele_rows(
+        "quantitative")
+    assert_equal(allele_to_rows["A"], [1])
+    allele_to_rows = train_allele_specific_models_command.train_data_allele_rows()
+    assert_equal(allele_to_rows["A"], [1])
+    assert_equal(allele_to_rows["B"], [0])
+    global_data.clear()
+
+
 def test_run_parallel():
     run_and_check(n_jobs=2)
     run_and_check_with_model_selection(n_jobs=2)